@@ -1,10 +1,20 @@
 import serial
 import argparse
 import threading
-import json
+import collections
+import multiprocessing
 import curses
-from enum import Enum
+import os
 import time
+import struct
+import array
+import errno
+import fcntl
+import termios
+import select
+import signal
+import sys
+import tty
 
 PORT = "/dev/ttyTHS1"   # change to /dev/ttyUSB0 if using USB serial
 BAUD = 115200
@@ -12,188 +22,378 @@ BAUD = 115200
 SEND_HZ = 30            # heartbeat command rate
 KEY_HOLD_S = 0.18       # if no repeat within this time, key considered released
 DEADMAN_S = 0.50      
+SPIN_S = 0.001          # busy-wait the final stretch before each send deadline
+KEEPALIVE_S = 0.20      # resend an unchanged command at least this often
+UI_ACTIVE_S = 0.20      # poll keys fast for this long after the last keypress
+UI_FAST_DT = 0.002      # UI poll interval while keys are active
+UI_IDLE_DT = 0.05       # UI poll interval while idle
+CONTROL_CPU = 2         # core the control process is pinned to
+CONTROL_PRIO = 20       # SCHED_FIFO priority for the control process
+TX_BACKLOG_MAX = 64     # skip a tick's write while more than this many bytes await TX
+RX_KEEP = 5             # most recent received lines kept and shown under the status
+RX_ROW = 11             # screen row the received lines start on
+
+# control characters (NUL from an ESP32 reset, line noise, CR) dropped from
+# received lines before they reach the screen
+RX_CLEAN = dict.fromkeys([*range(32), 127])
+
+# the loops keep time as integer time.perf_counter_ns() readings
+KEY_HOLD_NS = int(KEY_HOLD_S * 1e9)
+DEADMAN_NS = int(DEADMAN_S * 1e9)
+SPIN_NS = int(SPIN_S * 1e9)
+KEEPALIVE_NS = int(KEEPALIVE_S * 1e9)
+UI_ACTIVE_NS = int(UI_ACTIVE_S * 1e9)
+
+# Waveshare wheel speed control format; only the two floats change per send
+CMD_TMPL = b'{"T":1,"L":%.4f,"R":%.4f}\n'
+
+# same command as a 10-byte binary frame: sync byte, type, L, R
+BIN_SYNC = 0xAA
+BIN_CMD = struct.Struct('<BBff')
+
+ASYNC_LOW_LATENCY = 1 << 13   # linux/tty_flags.h
+
+# key "expires" per slot (if now > expire -> treated as not held)
+key_exp = [0] * 4
+
+# key -> expiry slot (w, s, a, d = 0..3) or an action code
+KEY_NONE, KEY_STOP, KEY_QUIT = -1, -2, -3
+KEY_SLOT = [KEY_NONE] * 256
+KEY_SLOT[ord('w')] = 0
+KEY_SLOT[ord('s')] = 1
+KEY_SLOT[ord('a')] = 2
+KEY_SLOT[ord('d')] = 3
+KEY_SLOT[ord('x')] = KEY_STOP
+KEY_SLOT[ord('q')] = KEY_QUIT
+
+SPEED_LOW, SPEED_MED, SPEED_HIGH = 0.0, 0.25, 0.5
+
+def build_cmd_table():
+    # (L, R) for every held-key combination, indexed by w | s<<1 | a<<2 | d<<3
+    table = []
+    for idx in range(16):
+        w, s, a, d = idx & 1, idx >> 1 & 1, idx >> 2 & 1, idx >> 3 & 1
+        # first matching direction wins; opposite keys cancel out
+        if w and not s:
+            table.append((SPEED_HIGH, SPEED_HIGH))
+        elif s and not w:
+            table.append((-SPEED_MED, -SPEED_MED))
+        elif a and not d:
+            table.append((-SPEED_HIGH, SPEED_HIGH))
+        elif d and not a:
+            table.append((SPEED_HIGH, -SPEED_HIGH))
+        else:
+            table.append((SPEED_LOW, SPEED_LOW))
+    return tuple(table)
 
-lock = threading.Lock()
+CMD_TABLE = build_cmd_table()
 
-class speed(Enum):
-    LOW: 0
-    MED: 0.25
-    HIGH: 0.5
+def encode_command(L, R):
+    return CMD_TMPL % (L, R)
 
-def read_serial():
-    while True:
-        data = ser.readline().decode('utf-8')
-        if data:
-            print(f"Received: {data}", end='')
+def encode_command_bin(L, R):
+    return BIN_CMD.pack(BIN_SYNC, 1, L, R)
 
-def control_loop():
-    global x_cmd, z_cmd, last_any_key_time
-    dt = 1.0 / SEND_HZ
+# every command frame pre-encoded, indexed like CMD_TABLE (0 = stop)
+CMD_FRAMES = tuple(encode_command(L, R) for L, R in CMD_TABLE)
+CMD_FRAMES_BIN = tuple(encode_command_bin(L, R) for L, R in CMD_TABLE)
 
-    while True:
-        now = time.time()
-        with lock:
-            L_cmd = L
-            R_cmd = R
-            t_any = last_any_key_time
+def read_serial(ser, stop_evt, rx_conn):
+    # hands each received line to the UI process, which owns the terminal
+    buf = bytearray()
+    try:
+        while not stop_evt.is_set():
+            # wait for data with a timeout so the stop event gets checked
+            r, _, _ = select.select([ser.fd], [], [], 0.1)
+            if not r:
+                continue
+            # drain whatever is queued in one read, then split lines ourselves
+            buf += ser.read(max(1, ser.in_waiting))
+            *lines, buf = buf.split(b'\n')
+            for line in lines:
+                rx_conn.send_bytes(line)
+    except (serial.SerialException, OSError):
+        pass   # port or UI gone; the control loop's next write notices
+
+def set_low_latency(ser):
+    # ask the USB-serial driver to skip its ~16ms RX coalescing timer
+    try:
+        buf = array.array('i', [0] * 32)   # struct serial_struct, padded
+        fcntl.ioctl(ser.fd, termios.TIOCGSERIAL, buf)
+        buf[4] |= ASYNC_LOW_LATENCY        # serial_struct.flags
+        fcntl.ioctl(ser.fd, termios.TIOCSSERIAL, buf)
+    except (AttributeError, OSError):
+        pass   # no TIOCGSERIAL (macOS/BSD), or not a serial tty
+
+def tx_pending(ser):
+    # bytes still queued in the kernel TX buffer
+    try:
+        buf = array.array('i', [0])
+        fcntl.ioctl(ser.fd, termios.TIOCOUTQ, buf)
+        return buf[0]
+    except AttributeError:
+        return 0   # no TIOCOUTQ: never hold off
+    except OSError as e:
+        if e.errno in (errno.ENOTTY, errno.EINVAL):
+            return 0   # not a tty: never hold off
+        raise   # port gone; the control loop deals with it
+
+def set_realtime():
+    # pin to one core and ask for SCHED_FIFO; needs CAP_SYS_NICE, best effort
+    try:
+        os.sched_setaffinity(0, {CONTROL_CPU})
+    except (AttributeError, OSError):
+        pass   # not Linux, or that core doesn't exist
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(CONTROL_PRIO))
+    except (AttributeError, OSError):
+        pass   # not permitted, stay on the normal scheduler
+
+def control_loop(port, cmd_idx, last_any_key_time, ready_evt, stop_evt, rx_conn, binary=False):
+    # runs in its own process so UI work never holds the GIL across a send
+    # Ctrl-C is the UI's to handle; its shutdown sets stop_evt so we still
+    # get to send the stop frames below
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    frames = CMD_FRAMES_BIN if binary else CMD_FRAMES
+    ser = serial.Serial(port, baudrate=BAUD, dsrdtr=None, timeout=0, write_timeout=0)
+    ser.rts = False
+    ser.dtr = False
+    # drop power-on garbage and anything left queued from a previous run
+    ser.reset_input_buffer()
+    ser.reset_output_buffer()
+    set_low_latency(ser)
+
+    # reader shares this process's port and stops on the same event; start it
+    # before set_realtime so it keeps the normal scheduler and any core
+    reader = threading.Thread(target=read_serial, args=(ser, stop_evt, rx_conn), daemon=True)
+    reader.start()
+    set_realtime()
+    ready_evt.set()
+
+    dt = 1_000_000_000 // SEND_HZ
+    next_deadline = time.perf_counter_ns()
+    last_sent = None
+    last_send_time = 0
+    pending = b''   # unwritten tail of the frame being sent
+
+    while not stop_evt.is_set():
+        now = time.perf_counter_ns()
+        idx = cmd_idx.value
+        t_any = last_any_key_time.value
 
         # absolute deadman safety
-        if now - t_any > DEADMAN_S:
-            L_cmd, R_cmd = 0.0, 0.0
-
-        try:
-            send_command(L_cmd, R_cmd)
-        except Exception:
+        if now - t_any > DEADMAN_NS:
+            idx = 0
+
+        # send on change; otherwise only a slow keep-alive for the MCU deadman
+        frame = frames[idx]
+        due = frame != last_sent or now - last_send_time > KEEPALIVE_NS
+
+        # writes don't block; hold off while the link is still backed up. A
+        # short write leaves the rest of the frame in pending, which goes out
+        # ahead of anything new on the next tick so frames never interleave
+        if pending or due:
+            try:
+                if tx_pending(ser) <= TX_BACKLOG_MAX:
+                    if not pending:
+                        pending = last_sent = frame
+                        last_send_time = now
+                    pending = pending[ser.write(pending):]
+            except serial.SerialTimeoutException:
+                pass   # TX queue full for now; try again next tick
+            except (serial.SerialException, OSError):
+                # port went away (unplugged, MCU reset): nothing left to send
+                # on, so exit non-zero and let the UI see we're gone
+                sys.exit(1)
+
+        # absolute-deadline pacing: sleep most of the way, spin the last bit
+        next_deadline += dt
+        remaining = next_deadline - time.perf_counter_ns()
+        if remaining < -dt:
+            # fell behind by more than a tick: resync instead of bursting
+            next_deadline = time.perf_counter_ns()
+            continue
+        if remaining > SPIN_NS:
+            time.sleep((remaining - SPIN_NS) / 1e9)
+        while time.perf_counter_ns() < next_deadline:
             pass
 
-        time.sleep(dt)
-
-def ui_loop(stdscr):
-    global L, R, last_any_key_time, w_exp, s_exp, a_exp, d_exp
-
-    curses.curs_set(0)
-    stdscr.nodelay(True)      # getch() won't block
-    stdscr.keypad(True)
+    # after UI exits, send a couple stop commands for safety
+    try:
+        ser.write_timeout = 0.1   # block from here on so each frame goes out whole
+        ser.write(pending + frames[0])
+        time.sleep(0.05)
+        ser.write(frames[0])
+        ser.flush()
+    except Exception:
+        pass
+    reader.join(timeout=0.5)
+    ser.close()
+
+def read_keys(stdscr):
+    # every keypress queued since the last tick, as ints
+    if stdscr is None:
+        fd = sys.stdin.fileno()
+        r, _, _ = select.select([fd], [], [], 0)
+        return os.read(fd, 32) if r else b''
+    keys = []
+    ch = stdscr.getch()
+    while ch != -1:
+        keys.append(ch)
+        ch = stdscr.getch()
+    return keys
 
-    stdscr.addstr(0, 0, "WAVE ROVER Teleop (hold-to-drive over SSH)")
-    stdscr.addstr(2, 0, "Hold: w/s forward/back, a/d turn. Release -> stops.")
-    stdscr.addstr(3, 0, "x stop, q quit")
-    stdscr.addstr(5, 0, f"PORT={PORT}  BAUD={BAUD}  SEND={SEND_HZ}Hz  KEY_HOLD={KEY_HOLD_S}s")
+def run_raw(control, cmd_idx, last_any_key_time, rx_conn):
+    # cbreak stdin without curses: keys arrive unbuffered and nothing is redrawn
+    fd = sys.stdin.fileno()
+    saved = termios.tcgetattr(fd)
+    print("WAVE ROVER Teleop (no curses): hold w/s/a/d to drive, x stop, q quit")
+    try:
+        tty.setcbreak(fd)
+        ui_loop(None, control, cmd_idx, last_any_key_time, rx_conn)
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+
+def ui_loop(stdscr, control, cmd_idx, last_any_key_time, rx_conn):
+    # stdscr is None when running headless via run_raw
+    if stdscr is not None:
+        curses.curs_set(0)
+        stdscr.nodelay(True)      # getch() won't block
+        stdscr.keypad(True)
+
+        stdscr.addstr(0, 0, "WAVE ROVER Teleop (hold-to-drive over SSH)")
+        stdscr.addstr(2, 0, "Hold: w/s forward/back, a/d turn. Release -> stops.")
+        stdscr.addstr(3, 0, "x stop, q quit")
+        stdscr.addstr(5, 0, f"PORT={PORT}  BAUD={BAUD}  SEND={SEND_HZ}Hz  KEY_HOLD={KEY_HOLD_S}s")
+        height, width = stdscr.getmaxyx()
+        width -= 1
+        if RX_ROW < height:
+            stdscr.addstr(RX_ROW, 0, "Received:")
+
+    # most recent lines from the rover; bounded so a chatty MCU can't grow memory
+    rx_lines = collections.deque(maxlen=RX_KEEP)
+    rx_count = 0
+
+    last_active = 0
+    prev_disp = None
 
     while True:
-        now = time.time()
+        # bail out if the control process died, e.g. the port went away
+        if not control.is_alive():
+            return
+
+        now = time.perf_counter_ns()
 
         # read as many queued keypresses as available this tick
-        ch = stdscr.getch()
         quit_now = False
         stop_now = False
         got_any = False
 
-        while ch != -1:
+        for ch in read_keys(stdscr):
             got_any = True
-            if ch == ord('w'):
-                w_exp = now + KEY_HOLD_S
-            elif ch == ord('s'):
-                s_exp = now + KEY_HOLD_S
-            elif ch == ord('a'):
-                a_exp = now + KEY_HOLD_S
-            elif ch == ord('d'):
-                d_exp = now + KEY_HOLD_S
-            elif ch == ord('x'):
+            slot = KEY_SLOT[ch] if 0 <= ch < 256 else KEY_NONE
+            if slot >= 0:
+                key_exp[slot] = now + KEY_HOLD_NS
+            elif slot == KEY_STOP:
                 stop_now = True
-            elif ch == ord('q'):
+            elif slot == KEY_QUIT:
                 quit_now = True
-            ch = stdscr.getch()
+
+        if got_any:
+            last_active = now
+
+        # lines the rover sent since the last tick
+        while rx_conn.poll():
+            text = rx_conn.recv_bytes().decode('utf-8', errors='replace').translate(RX_CLEAN)
+            rx_lines.append(text)
+            rx_count += 1
+            if stdscr is None:
+                print(f"Received: {text}")
 
         # determine "held" status from timers
-        w_on = now <= w_exp
-        s_on = now <= s_exp
-        a_on = now <= a_exp
-        d_on = now <= d_exp
+        w_on, s_on, a_on, d_on = [now <= t for t in key_exp]
 
 
         if stop_now:
-            new_L, new_R = 0.0, 0.0
+            idx = 0
             # also clear holds
-            w_exp = s_exp = a_exp = d_exp = 0.0
+            key_exp[:] = [0] * 4
             got_any = True  # counts as activity
         else:
-            # X: if both held, cancel out (0). If one held, choose that direction.
-            if w_on and not s_on:
-                new_R = speed.HIGH
-                new_L = speed.HIGH
-            elif s_on and not w_on:
-                new_R = -speed.MED
-                new_L = -speed.MED
-            elif a_on and not d_on:
-                new_R = speed.HIGH
-                new_L = -speed.HIGH
-
-            elif d_on and not a_on:
-                new_R = -speed.HIGH
-                new_L = speed.HIGH
-            else:
-                new_L = speed.LOW
-                new_R = speed.LOW
-
-        with lock:
-            L = new_L
-            R = new_R
-            if got_any:
-                last_any_key_time = now
-
-        # display
-        stdscr.addstr(7, 0, f"Held: W={w_on} S={s_on} A={a_on} D={d_on}          ")
-        stdscr.addstr(8, 0, f"Cmd:  X={new_L:+.2f} m/s   Z={new_R:+.2f} rad/s        ")
-        stdscr.addstr(9, 0, f"Last input age: {now - last_any_key_time:.2f}s (deadman {DEADMAN_S}s)     ")
-        stdscr.refresh()
+            idx = w_on | s_on << 1 | a_on << 2 | d_on << 3
+
+        new_L, new_R = CMD_TABLE[idx]
+        cmd_idx.value = idx
+        if got_any:
+            last_any_key_time.value = now
+
+        # display, only redrawn when something visible changed
+        age = round((now - last_any_key_time.value) / 1e9, 1)
+        disp = (w_on, s_on, a_on, d_on, new_L, new_R, age, rx_count)
+        if stdscr is not None and disp != prev_disp:
+            prev_disp = disp
+            stdscr.addstr(7, 0, f"Held: W={w_on} S={s_on} A={a_on} D={d_on}          ")
+            stdscr.addstr(8, 0, f"Cmd:  X={new_L:+.2f} m/s   Z={new_R:+.2f} rad/s        ")
+            stdscr.addstr(9, 0, f"Last input age: {age:.1f}s (deadman {DEADMAN_S}s)     ")
+            # clip to the terminal; rows past the bottom would raise curses.error
+            for row, text in zip(range(RX_ROW + 1, height), rx_lines):
+                stdscr.addnstr(row, 0, text.ljust(width), width)
+            stdscr.refresh()
 
         if quit_now:
             # stop on exit
-            with lock:
-                L = speed.LOW
-                R = speed.LOW
-                last_any_key_time = time.time()
+            cmd_idx.value = 0
+            last_any_key_time.value = time.perf_counter_ns()
             return
 
-        time.sleep(0.02)
+        # poll fast while driving, back off when idle
+        sleep_dt = UI_FAST_DT if now - last_active < UI_ACTIVE_NS else UI_IDLE_DT
+        if stdscr is None:
+            select.select([sys.stdin], [], [], sleep_dt)   # wakes early on a key
+        else:
+            time.sleep(sleep_dt)
 
 
 def main():
-    global ser
-    parser = argparse.ArgumentParser(description='Serial JSON Communication')
-    parser.add_argument('port', type=str, help='Serial port name (e.g., COM1 or /dev/ttyUSB0)')
-
+    parser = argparse.ArgumentParser(description='Hold-to-drive teleop for WAVE ROVER')
+    parser.add_argument('port', type=str, help='Serial port name (e.g., /dev/ttyTHS1 or /dev/ttyUSB0)')
+    parser.add_argument('--binary', action='store_true', help='send binary frames instead of JSON')
+    parser.add_argument('--nocurses', action='store_true', help='read raw stdin keys, no screen drawing')
 
     args = parser.parse_args()
 
-    ser = serial.Serial(args.port, baudrate=115200, dsrdtr=None)
-
-
-    threading.Thread(target=control_loop, args=(ser,), daemon=True).start()
-
-    curses.wrapper(ui_loop)
+    ready_evt = multiprocessing.Event()
+    stop_evt = multiprocessing.Event()
+    # shared with the control process; aligned int slots load/store atomically,
+    # so each slot is read and written without a lock
+    cmd_idx = multiprocessing.Value('i', 0, lock=False)   # held-key index into CMD_TABLE
+    last_any_key_time = multiprocessing.Value('q', time.perf_counter_ns(), lock=False)
+    rx_recv, rx_send = multiprocessing.Pipe(duplex=False)
+    control = multiprocessing.Process(
+        target=control_loop,
+        args=(args.port, cmd_idx, last_any_key_time, ready_evt, stop_evt, rx_send, args.binary),
+        daemon=True,
+    )
+    control.start()
+
+    # don't take keys until the control process has the port open
+    while not ready_evt.wait(0.05):
+        if not control.is_alive():
+            sys.exit(f"could not open serial port {args.port}")
 
-    # after UI exits, send a couple stop commands for safety
     try:
-        send_command(0.0, 0.0)
-        time.sleep(0.05)
-        send_command(0.0, 0.0)
-    except Exception:
-        pass
-
-
-if __name__ == "__main__":
-    main()
-
-
-    ser.setRTS(False)
-    ser.setDTR(False)
-
-    serial_recv_thread = threading.Thread(target=read_serial)
-    serial_recv_thread.daemon = True
-    serial_recv_thread.start()
-
-    try:
-        while True:
-            command = input("")
-            ser.write(command.encode() + b'\n')
-    except KeyboardInterrupt:
-        pass
+        if args.nocurses:
+            run_raw(control, cmd_idx, last_any_key_time, rx_recv)
+        else:
+            curses.wrapper(ui_loop, control, cmd_idx, last_any_key_time, rx_recv)
     finally:
-        ser.close()
+        # control process sends the final stop commands on its way out
+        stop_evt.set()
+        control.join(timeout=1.0)
+
+    if control.exitcode:
+        sys.exit(f"control process exited with code {control.exitcode}")
 
 
 if __name__ == "__main__":
     main()
-
-global L_speed
-global R_speed
-
-
-def send_command(L, R):
-    command_dict = {"T":1,"L":L,"R":R}
-    json_cmd = json.dumps((command_dict), '\n')
-    ser.write((json.dumps(json_cmd) + "\n").encode("utf-8"))
-
-